@@ -1,9 +1,16 @@
 # app.py
 import io
 import os
+import re
+import hashlib
+import tempfile
 import datetime
 import pytz
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import streamlit as st
 
 # =========================
@@ -86,154 +93,309 @@ if limpiar_resultados:
     results_dir = "resultados"
     os.makedirs(results_dir, exist_ok=True)
     cst = pytz.timezone("America/Mexico_City")
-    today = datetime.datetime.now(cst).strftime("%Y%m%d")
+    # Medianoche de hoy (CDMX): cualquier .xlsx modificado antes es de un día anterior
+    hoy = datetime.datetime.now(cst).date()
+    medianoche = cst.localize(datetime.datetime.combine(hoy, datetime.time())).timestamp()
     removed = []
-    for fname in os.listdir(results_dir):
-        if not fname.endswith(".xlsx"):
-            continue
-        parts = fname.split("_")
-        if len(parts) >= 2:
-            date_part = parts[1]
-            if not date_part.startswith(today):
-                try:
-                    os.remove(os.path.join(results_dir, fname))
-                    removed.append(fname)
-                except Exception:
-                    pass
+    with os.scandir(results_dir) as it:
+        for entry in it:
+            if not (entry.name.endswith(".xlsx") and entry.is_file()):
+                continue
+            try:
+                if entry.stat().st_mtime < medianoche:
+                    os.remove(entry.path)
+                    removed.append(entry.name)
+            except OSError:
+                pass
     if removed:
         st.toast(f"🗑️ Eliminados {len(removed)} archivos antiguos en 'resultados'")
 
 # =========================
 # LECTURA + VALIDACIÓN DE ENTRADA
 # =========================
-dataframes = {}
-for upl in files:
-    prov_name = os.path.splitext(upl.name)[0]
+class SKUsInvalidos(ValueError):
+    """El archivo trae SKUs que no son solo dígitos; `skus` guarda las filas culpables."""
+    def __init__(self, archivo, skus):
+        super().__init__(f"SKUs inválidos en {archivo}. Solo dígitos permitidos.")
+        self.archivo = archivo
+        self.skus = skus
+
+
+SKU_RE = re.compile(r'[0-9]+')
+
+
+def skus_invalidos(sku: pd.Series) -> np.ndarray:
+    """Máscara booleana de SKUs que no son solo dígitos (vacíos y nulos cuentan como inválidos)."""
+    if isinstance(sku.dtype, pd.StringDtype) and sku.dtype.storage == "pyarrow":
+        # chequeo de rango de bytes ('0'..'9') en C++ sobre los buffers de Arrow, sin regex por fila
+        ok = pc.fill_null(pc.ascii_is_decimal(pa.array(sku.array)), False)
+        return pc.invert(ok).to_numpy(zero_copy_only=False)
+    return ~sku.str.fullmatch(SKU_RE, na=False).to_numpy(dtype=bool)
+
+
+# Shards Parquet normalizados, uno por archivo subido (nombrados por versión + hash del contenido).
+# Subir SHARD_VERSION cada vez que cambie la normalización o el esquema de parse_provider.
+SHARDS_DIR = os.path.join(tempfile.gettempdir(), "cotizador_shards")
+SHARD_VERSION = 2
+SHARDS_TTL = 24 * 60 * 60  # segundos sin usarse antes de borrar un shard
+
+
+def parse_provider(name: str, data: bytes) -> pd.DataFrame:
+    """Lee, valida y normaliza el Excel de un proveedor."""
     try:
-        df = pd.read_excel(upl)
-
-        # Normaliza headers
-        df.columns = df.columns.str.strip()
-
-        # Columnas mínimas
-        min_cols = ['SKU', 'Precio Unitario']
-        if not all(c in df.columns for c in min_cols):
-            st.error(f"❌ {upl.name} no tiene columnas mínimas {min_cols}.")
-            st.stop()
-
-        if 'Nombre' not in df.columns:
-            df['Nombre'] = ""
-
-        df['Proveedor'] = prov_name
-
-        # SKU: string limpio y validación estricta (solo dígitos)
-        df['SKU'] = df['SKU'].astype(str).str.strip()
-        invalid_skus = df[~df['SKU'].str.match(r'^\d+$', na=False)]
-        if not invalid_skus.empty:
-            st.error(f"❌ SKUs inválidos en {upl.name}. Solo dígitos permitidos.")
-            st.dataframe(invalid_skus[['SKU']])
-            st.stop()
-
-        # Normaliza Nombre
-        df['Nombre'] = df['Nombre'].astype(str).str.strip()
-
-        # Precio: limpia símbolos y convierte
-        df['Precio Unitario'] = (
-            df['Precio Unitario'].astype(str)
-              .str.replace(r'[^0-9,\.\-]', '', regex=True)
-              .str.replace(',', '', regex=False)  # ajusta si usas coma decimal
-        )
-        df['Precio Unitario'] = pd.to_numeric(df['Precio Unitario'], errors='coerce')
-
-        dataframes[prov_name] = df
-
-        if mostrar_previas:
-            st.success(f"✅ Cargado: {upl.name}")
-            st.dataframe(df.head())
+        # calamine (nativo) en lugar de openpyxl; todo como texto, se tipa abajo
+        df = pd.read_excel(io.BytesIO(data), engine="calamine", dtype="string")
     except Exception as e:
-        st.error(f"❌ Error leyendo {upl.name}: {e}")
-        st.stop()
+        raise ValueError(f"Error leyendo {name}: {e}") from e
 
-if not dataframes:
-    st.error("No se cargaron datos válidos.")
-    st.stop()
+    # Normaliza headers
+    df.columns = df.columns.str.strip()
 
-# =========================
-# MERGE + NOMBRE CANÓNICO
-# =========================
-merged_df = pd.concat(dataframes.values(), ignore_index=True)
-merged_df['SKU'] = merged_df['SKU'].astype(str).str.strip()
-
-# Nombre canónico por SKU (mode; si no hay, el más largo)
-nombres_canon = (
-    merged_df.assign(Nombre_norm=merged_df['Nombre'].astype(str).str.strip())
-             .groupby('SKU')['Nombre_norm']
-             .agg(lambda s: s.mode().iloc[0] if not s.mode().empty else (max(s, key=len) if len(s) else ""))
-             .rename('Nombre_canonico')
-             .reset_index()
-)
-merged_df = merged_df.merge(nombres_canon, on='SKU', how='left')
+    # Columnas mínimas
+    min_cols = ['SKU', 'Precio Unitario']
+    if not all(c in df.columns for c in min_cols):
+        raise ValueError(f"{name} no tiene columnas mínimas {min_cols}.")
 
-# Orden básico
-merged_df = merged_df.sort_values(by='SKU', ascending=True).reset_index(drop=True)
+    if 'Nombre' not in df.columns:
+        df['Nombre'] = ""
 
-if mostrar_previas:
-    st.subheader("📊 Vista combinada (primeras filas)")
-    st.dataframe(merged_df.head(20))
+    # SKU: string limpio y validación estricta (solo dígitos)
+    df['SKU'] = df['SKU'].astype('string[pyarrow]').str.strip()
+    invalid_skus = df[skus_invalidos(df['SKU'])]
+    if not invalid_skus.empty:
+        raise SKUsInvalidos(name, invalid_skus[['SKU']])
 
-# =========================
-# EMPATES/MEJORES (con columna comparativa)
-# =========================
-tmp = merged_df.dropna(subset=['Precio Unitario']).copy()
-tmp['Precio_cmp'] = pd.to_numeric(tmp['Precio Unitario'], errors='coerce').round(precision_empate)
+    # Normaliza Nombre
+    df['Nombre'] = df['Nombre'].astype(str).str.strip()
 
-# Mínimo por SKU (comparativa)
-min_por_sku = tmp.groupby('SKU')['Precio_cmp'].transform('min')
+    # Precio: limpia símbolos (y separador de miles) en una pasada de Arrow y convierte
+    precios = pc.replace_substring_regex(
+        pa.array(df['Precio Unitario'].astype('string[pyarrow]').array),
+        pattern=r'[^0-9.\-]', replacement='',  # ajusta si usas coma decimal
+    )
+    df['Precio Unitario'] = pd.to_numeric(precios.to_numpy(zero_copy_only=False), errors='coerce')
 
-# Ganador mínimo por SKU (uno)
-idx = tmp.groupby('SKU')['Precio_cmp'].idxmin()
-mejores_precios_df = tmp.loc[idx].sort_values('SKU').reset_index(drop=True)
+    # Esquema fijo (columnas, orden y tipos) para que todos los shards sean concatenables,
+    # aunque el archivo traiga columnas extra, otro orden o precios todos enteros
+    return df[['SKU', 'Nombre', 'Precio Unitario']].astype({
+        'SKU': 'string[pyarrow]',
+        'Nombre': 'string[pyarrow]',
+        'Precio Unitario': 'float64',
+    })
 
-# Empates: todos los que igualan el mínimo (con la precisión deseada)
-empates_df = (
-    tmp[min_por_sku == tmp['Precio_cmp']]
-      .sort_values(['SKU', 'Proveedor'])
-      .reset_index(drop=True)
-)
 
-# Derivados para resumen
-_emp = empates_df.copy()
-_emp['SKU_str'] = _emp['SKU'].astype(str)
-_emp['SKU_num'] = pd.to_numeric(_emp['SKU'], errors='coerce')
+def load_provider(name: str, data: bytes) -> str:
+    """Normaliza el Excel de un proveedor a un shard Parquet y regresa su ruta.
 
-counts = _emp.groupby('SKU_str')['SKU_str'].transform('size')
-ganadores_unicos = _emp[counts == 1].copy()
-empates_reales  = _emp[counts > 1].copy()
+    El shard se nombra por el hash de los bytes: en cada rerun (o si se vuelve a subir
+    el mismo archivo) se reutiliza sin releer el Excel, y el DataFrame no se queda en RAM.
+    """
+    path = os.path.join(SHARDS_DIR, f"v{SHARD_VERSION}-{hashlib.sha256(data).hexdigest()}.parquet")
+    try:
+        os.utime(path)  # reutilizado: se marca como usado para que la limpieza no lo borre
+        return path
+    except FileNotFoundError:
+        pass
+    df = parse_provider(name, data)
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    limpiar_shards()
+    # Temporal único por escritor: las sesiones de Streamlit son hilos del mismo proceso.
+    # Lleva el prefijo de versión para que limpiar_shards solo lo borre si quedó abandonado.
+    fd, tmp_path = tempfile.mkstemp(dir=SHARDS_DIR, prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        df.to_parquet(tmp_path, engine="pyarrow", compression="zstd", index=False)
+        if not os.path.exists(path):
+            os.replace(tmp_path, path)  # atómico: nunca se lee un shard a medias
+    except FileNotFoundError:
+        # Otro escritor ganó (mismo archivo subido en otra sesión): su shard sirve igual
+        if not os.path.exists(path):
+            raise
+    finally:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+    del df
+    return path
+
+
+def limpiar_shards() -> None:
+    """Borra shards de otra versión y los que llevan más de SHARDS_TTL sin usarse."""
+    limite = datetime.datetime.now().timestamp() - SHARDS_TTL
+    prefijo = f"v{SHARD_VERSION}-"
+    with os.scandir(SHARDS_DIR) as it:
+        for entry in it:
+            try:
+                if not entry.name.startswith(prefijo) or entry.stat().st_mtime < limite:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def build_merged(shards: tuple, precision_empate: int):
+    """Combina proveedores, calcula nombre canónico, mejores precios y empates.
+
+    `shards` es una tupla ordenada de (proveedor, ruta_parquet).
+    Regresa (merged_df, mejores_precios_df, ganadores_unicos, empates_reales).
+    """
+    # MERGE + NOMBRE CANÓNICO: los shards se concatenan en Arrow y se convierten una sola vez
+    tablas = [pq.read_table(path) for _, path in shards]
+    merged_df = pa.concat_tables(tablas, promote_options="default").to_pandas()
+
+    # Proveedor como categoría (códigos enteros) armada directo por bloques, sin repetir strings
+    prov_cats = pd.CategoricalDtype(categories=[prov for prov, _ in shards])
+    merged_df['Proveedor'] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(shards)), [t.num_rows for t in tablas]), dtype=prov_cats
+    )
+    del tablas
+
+    # Códigos densos (SKU -> int32 en orden numérico, proveedor -> códigos de la categoría) una
+    # sola vez; todo lo que sigue agrupa y ordena sobre estos enteros chicos. El SKU se queda
+    # como el texto validado (conserva ceros a la izquierda para mostrar y exportar).
+    sku_codes, sku_levels = pd.factorize(merged_df['SKU'])
+    niveles = sku_levels.to_numpy(dtype=object)
+    sin_ceros = sku_levels.str.lstrip('0')
+    # orden numérico de texto de solo dígitos: largo sin ceros, dígitos, y luego el texto original
+    orden = np.lexsort((niveles, sin_ceros.to_numpy(dtype=object), sin_ceros.str.len().to_numpy()))
+    rango = np.empty(len(orden), dtype=np.int32)
+    rango[orden] = np.arange(len(orden), dtype=np.int32)
+    merged_df['_sku'] = rango[sku_codes]
+    merged_df['_prov'] = merged_df['Proveedor'].cat.codes
+
+    # Nombre canónico por SKU (el más frecuente; en empate, el más largo).
+    # Conteo + orden vectorizados en vez de un lambda por grupo. Solo se ordena por llaves
+    # enteras: el conteo ya sale ordenado por nombre y el orden de varias columnas es
+    # estable, así que el desempate alfabético se conserva sin comparar strings.
+    conteo = merged_df.groupby(['_sku', 'Nombre'], dropna=False).size().reset_index(name='n')
+    conteo['len'] = conteo['Nombre'].str.len().fillna(0).astype('int16')
+    nombres_canon = (
+        conteo.sort_values(['_sku', 'n', 'len'], ascending=[True, False, False])
+              .drop_duplicates('_sku')[['_sku', 'Nombre']]
+              .rename(columns={'Nombre': 'Nombre_canonico'})
+    )
+    merged_df = merged_df.merge(nombres_canon, on='_sku', how='left')
+
+    # Orden básico
+    merged_df = merged_df.sort_values(by='_sku', ascending=True, kind='stable').reset_index(drop=True)
+
+    # EMPATES/MEJORES (con arreglo comparativo; no se toca el frame)
+    tmp = merged_df.dropna(subset=['Precio Unitario'])
+    # Comparativa exacta en enteros: precio en unidades de la precisión elegida
+    # (p. ej. centavos con 2 decimales), así dos precios solo empatan si redondean igual
+    precios = tmp['Precio Unitario'].to_numpy(dtype=float)
+    escalado = np.rint(precios * 10 ** int(precision_empate))
+    if np.abs(escalado).max(initial=0) < 2.0 ** 63:
+        precio_cmp = escalado.astype(np.int64)
+        tope = np.iinfo(np.int64).max
+    else:
+        # Algún precio no cabe en int64 (el cast daría la vuelta a INT64_MIN y "ganaría"):
+        # se comparan los float64 redondeados, como antes
+        precio_cmp = np.round(precios, int(precision_empate))
+        tope = np.inf
+
+    # Mínimo y empates por SKU en una sola pasada sobre los códigos densos:
+    # mínimo por grupo con np.minimum.at y conteo de empates con bincount
+    codes = tmp['_sku'].to_numpy()
+    min_arr = np.full(len(sku_levels), tope, dtype=precio_cmp.dtype)
+    np.minimum.at(min_arr, codes, precio_cmp)
+    ties = precio_cmp == min_arr[codes]
+    tie_counts = np.bincount(codes[ties], minlength=len(sku_levels))
+
+    # Empates: todos los que igualan el mínimo (con la precisión deseada)
+    empates_df = tmp[ties]
+    n_empates = tie_counts[codes[ties]]
+
+    # Ganador mínimo por SKU (uno): la primera fila que iguala el mínimo. tmp ya viene
+    # ordenado por _sku, así que basta un barrido secuencial (sin idxmin + .loc ni re-ordenar)
+    mejores_precios_df = empates_df.drop_duplicates('_sku').reset_index(drop=True)
+
+    # Derivados para resumen
+    ganadores_unicos = empates_df[n_empates == 1]
+    empates_reales  = empates_df[n_empates > 1]
+
+    ganadores_unicos = ganadores_unicos.sort_values(
+        by=['_prov', '_sku'], ascending=[True, True]
+    ).reset_index(drop=True)
+
+    empates_reales = empates_reales.sort_values(
+        by=['_sku', '_prov', 'Precio Unitario'], ascending=[True, True, True]
+    ).reset_index(drop=True)
+
+    return merged_df, mejores_precios_df, ganadores_unicos, empates_reales
+
+
+# Acotada: cada entrada guarda varios DataFrames completos y la caché se comparte entre sesiones
+@st.cache_data(show_spinner=False, max_entries=8, ttl=datetime.timedelta(hours=12))
+def build_all(file_payloads: tuple, precision_empate: int):
+    """Todo el trabajo de datos: lectura, merge, nombre canónico y empates.
+
+    Solo depende de los archivos y de `precision_empate`, así que los reruns por widgets
+    (selectbox, cantidades, checkboxes) lo toman de la caché sin recalcular nada.
+    `file_payloads` es una tupla de (nombre_archivo, bytes).
+    Regresa (merged_df, mejores_precios_df, ganadores_unicos, empates_reales).
+    """
+    shards = {}
+    for name, data in file_payloads:
+        shards[os.path.splitext(name)[0]] = load_provider(name, data)
+    if not shards:
+        raise ValueError("No se cargaron datos válidos.")
+    return build_merged(tuple(sorted(shards.items())), precision_empate)
+
+
+try:
+    merged_df, mejores_precios_df, ganadores_unicos, empates_reales = build_all(
+        tuple((upl.name, upl.getvalue()) for upl in files), precision_empate
+    )
+except SKUsInvalidos as e:
+    st.error(f"❌ {e}")
+    st.dataframe(e.skus)
+    st.stop()
+except Exception as e:
+    st.error(f"❌ {e}")
+    st.stop()
 
-ganadores_unicos = ganadores_unicos.sort_values(
-    by=['Proveedor', 'SKU_num', 'SKU_str'], ascending=[True, True, True]
-).reset_index(drop=True)
+if mostrar_previas:
+    for upl in files:
+        st.success(f"✅ Cargado: {upl.name}")
+        st.dataframe(pd.read_parquet(load_provider(upl.name, upl.getvalue())).head())
 
-empates_reales = empates_reales.sort_values(
-    by=['SKU_num', 'Proveedor', 'Precio Unitario'], ascending=[True, True, True]
-).reset_index(drop=True)
+if mostrar_previas:
+    st.subheader("📊 Vista combinada (primeras filas)")
+    st.dataframe(merged_df.drop(columns=['_sku', '_prov']).head(20))
 
 # =========================
 # RENDER RESUMEN EN HTML (mismo estilo)
 # =========================
 
 # ========= Helpers =========
-def fmt_money4(x):
-    try:
-        return f"${float(x):,.4f}"
-    except:
-        return x
+def fmt_money4(vals) -> list:
+    """Formatea una columna de montos como `$1,234.5678`."""
+    return [f"${v:,.4f}" for v in vals]
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def render_empates_html(emp_records: tuple) -> dict:
+    """Tabla HTML Proveedor/Precio de cada SKU empatado, memoizada por los registros.
+
+    `emp_records` es una tupla de (sku, proveedor, precio) ya ordenada; regresa {sku: html}.
+    """
+    filas = {}
+    for sku, prov, precio in emp_records:
+        filas.setdefault(str(sku), []).append((str(prov), float(precio)))
+    return {
+        sku: pd.DataFrame({
+            'Proveedor': [prov for prov, _ in f],
+            'Precio': fmt_money4(precio for _, precio in f),
+        }).to_html(index=False, classes='tbl', escape=False)
+        for sku, f in filas.items()
+    }
 
 if "empate_sel" not in st.session_state:
-    st.session_state.empate_sel = {}   # {sku_str: proveedor_elegido}
+    st.session_state.empate_sel = {}   # {sku: proveedor_elegido}
 
 if "cantidades" not in st.session_state:
-    st.session_state.cantidades = {}   # {(prov, sku_str): int}
+    st.session_state.cantidades = {}   # {(prov, sku): int}
 
 # ======== PESTAÑAS =========
 tab_empates, tab_pedido = st.tabs(["1) Resolver empates", "2) Armar pedido"])
@@ -246,12 +408,17 @@ with tab_empates:
         st.info("No hay empates.")
     else:
         PLACEHOLDER = "— Selecciona proveedor —"
-        skus_empatados = sorted(empates_reales['SKU_str'].unique())
+        skus_empatados = empates_reales['SKU'].unique()
+
+        tablas_html = render_empates_html(tuple(
+            empates_reales[['SKU','Proveedor','Precio Unitario']].itertuples(index=False, name=None)
+        ))
 
         # 1) Build a fresh dict of selections based on current widgets
         sel_temp = dict(st.session_state.empate_sel)  # start from previous state (if any)
 
-        for sku, g in empates_reales.groupby('SKU_str', sort=False):
+        for _, g in empates_reales.groupby('_sku', sort=False):
+            sku = str(g['SKU'].iat[0])
             nombre = g.iloc[0]['Nombre_canonico']
             st.markdown(f"**SKU {sku} — {nombre}**")
 
@@ -277,9 +444,7 @@ with tab_empates:
                 sel_temp.pop(sku, None)
 
             # Tabla informativa
-            g_show = g[['Proveedor','Precio Unitario']].rename(columns={'Precio Unitario':'Precio'}).copy()
-            g_show['Precio'] = g_show['Precio'].map(lambda x: f"${float(x):,.4f}")
-            st.markdown(g_show.to_html(index=False, classes='tbl', escape=False), unsafe_allow_html=True)
+            st.markdown(tablas_html[sku], unsafe_allow_html=True)
             st.write("")
 
         # 2) Persist the updated selections to session_state
@@ -294,17 +459,21 @@ with tab_empates:
 
 
 # ---------- Construir “ganadores” incluyendo elecciones (fuera de tabs para reutilizar) ----------
-gan_base = ganadores_unicos[['Proveedor','SKU','SKU_str','Nombre_canonico','Precio Unitario']].copy()
+gan_base = ganadores_unicos[['Proveedor','_sku','SKU','Nombre_canonico','Precio Unitario']]
 
 if not empates_reales.empty and len(st.session_state.empate_sel) > 0:
-    elegidas = []
-    for sku, prov_elegido in st.session_state.empate_sel.items():
-        block = empates_reales[(empates_reales['SKU_str'] == sku) & (empates_reales['Proveedor'] == prov_elegido)]
-        if not block.empty:
-            elegidas.append(block[['Proveedor','SKU','SKU_str','Nombre_canonico','Precio Unitario']].iloc[0])
-    gan_total = pd.concat([gan_base, pd.DataFrame(elegidas)], ignore_index=True) if elegidas else gan_base.copy()
+    # Un solo join contra las elecciones en vez de filtrar el frame por cada SKU elegido
+    sel_df = pd.DataFrame(
+        list(st.session_state.empate_sel.items()), columns=['SKU','Proveedor']
+    ).astype({'SKU': empates_reales['SKU'].dtype})
+    elegidas = (
+        empates_reales.merge(sel_df, on=['SKU','Proveedor'], how='inner')
+                      .drop_duplicates(['SKU','Proveedor'])
+                      [['Proveedor','_sku','SKU','Nombre_canonico','Precio Unitario']]
+    )
+    gan_total = pd.concat([gan_base, elegidas], ignore_index=True)
 else:
-    gan_total = gan_base.copy()
+    gan_total = gan_base
 
 # ---------- TAB 2: Armar pedido ----------
 with tab_pedido:
@@ -327,41 +496,47 @@ with tab_pedido:
       
           base = (
               gan_total[gan_total['Proveedor'] == prov]
-              [['SKU_str','Nombre_canonico','Precio Unitario']]
-              .rename(columns={'SKU_str':'SKU','Nombre_canonico':'Nombre'})
-              .assign(SKU_num=lambda d: pd.to_numeric(d['SKU'], errors='coerce'))
-              .sort_values('SKU_num')
-              .drop(columns='SKU_num')
-              .copy()
+              [['_sku','SKU','Nombre_canonico','Precio Unitario']]
+              .rename(columns={'Nombre_canonico':'Nombre'})
+              .sort_values('_sku')
+              .drop(columns='_sku')
           )
       
           if modo_flechas:
               # ===== MODO CON FLECHAS (number_input por fila) =====
+              # Dentro de un form: los cambios se aplican juntos al dar "Actualizar",
+              # en vez de un rerun completo por cada flechita.
               cantidades = []
-              for _, row in base.iterrows():
-                  sku = str(row['SKU'])
-                  name = str(row['Nombre'])
-                  key = (prov, sku)
-                  if key not in st.session_state.cantidades:
-                      st.session_state.cantidades[key] = 0
-                  qty = st.number_input(
-                      f"Cantidad — {name}",
-                      min_value=0, step=1,
-                      value=int(st.session_state.cantidades[key]),
-                      key=f"qty_{prov}_{sku}"
-                  )
-                  st.session_state.cantidades[key] = qty
-                  cantidades.append(qty)
+              with st.form(f"qty_form_{prov}"):
+                  for sku, name in zip(base['SKU'].to_numpy(), base['Nombre'].to_numpy()):
+                      sku = str(sku)
+                      qty = st.number_input(
+                          f"Cantidad — {name}",
+                          min_value=0, step=1,
+                          value=int(st.session_state.cantidades.get((prov, sku), 0)),
+                          key=f"qty_{prov}_{sku}"
+                      )
+                      cantidades.append(qty)
+                  st.form_submit_button("Actualizar")
+              st.session_state.cantidades.update(
+                  {(prov, str(sku)): int(q) for sku, q in zip(base['SKU'].to_numpy(), cantidades)}
+              )
       
-              g = base.copy()
-              g['Cantidad'] = cantidades
-              g['Total'] = (pd.to_numeric(g['Precio Unitario'], errors='coerce') * g['Cantidad']).fillna(0.0)
-              tablas_por_proveedor[prov] = g[['Cantidad','SKU','Nombre','Precio Unitario','Total']].copy()
+              precios = base['Precio Unitario'].to_numpy(dtype=float)
+              total_arr = np.nan_to_num(precios * np.asarray(cantidades))
+              tablas_por_proveedor[prov] = pd.DataFrame({
+                  'Cantidad': cantidades,
+                  'SKU': base['SKU'].to_numpy(),
+                  'Nombre': base['Nombre'].to_numpy(),
+                  'Precio Unitario': precios,
+                  'Total': total_arr,
+              })
       
               # Vista bonita
-              g_view = tablas_por_proveedor[prov].copy()
-              g_view['Precio Unitario'] = g_view['Precio Unitario'].map(lambda x: f"${float(x):,.4f}")
-              g_view['Total'] = g_view['Total'].map(lambda x: f"${float(x):,.4f}")
+              g_view = tablas_por_proveedor[prov].assign(**{
+                  'Precio Unitario': fmt_money4(precios),
+                  'Total': fmt_money4(total_arr),
+              })
               st.markdown(g_view.to_html(index=False, classes='tbl', escape=False), unsafe_allow_html=True)
       
           else:
@@ -382,16 +557,18 @@ with tab_pedido:
                   hide_index=True,
                   key=f"edit_{prov}"
               )
-              edited['Total'] = edited['Cantidad'] * edited['Precio Unitario']
+              qty = edited['Cantidad'].to_numpy()
+              total_arr = qty * edited['Precio Unitario'].to_numpy()
       
               # Persistir cantidades en session_state
-              for _, r in edited.iterrows():
-                  st.session_state.cantidades[(prov, str(r['SKU']))] = int(r['Cantidad'])
+              st.session_state.cantidades.update(
+                  {(prov, str(sku)): int(q) for sku, q in zip(base['SKU'].to_numpy(), qty)}
+              )
       
-              tablas_por_proveedor[prov] = edited[['Cantidad','SKU','Nombre','Precio Unitario','Total']].copy()
+              tablas_por_proveedor[prov] = edited[['Cantidad','SKU','Nombre','Precio Unitario']].assign(Total=total_arr)
       
           # ===== Subtotal por proveedor (común a ambos modos) =====
-          subtotal = float(tablas_por_proveedor[prov]['Total'].sum())
+          subtotal = float(total_arr.sum())
           subtotales[prov] = subtotal
           st.metric("Subtotal", f"${subtotal:,.4f}")
 
@@ -408,19 +585,29 @@ with tab_pedido:
             timestamp = datetime.datetime.now(cst).strftime("%Y%m%d_%H%M%S")
             excel_name = f"pedido_por_proveedor_{timestamp}.xlsx"
 
-            with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+            # constant_memory: xlsxwriter va bajando cada fila a disco en vez de guardar el libro
+            # entero; exige escribir fila por fila (to_excel escribe por columnas), así que las
+            # filas se escriben directo en la hoja.
+            columnas = ['Cantidad','SKU','Nombre','Precio Unitario','Total']
+            with pd.ExcelWriter(
+                output, engine="xlsxwriter",
+                engine_kwargs={"options": {"constant_memory": True, "strings_to_numbers": False}},
+            ) as writer:
+                # formato bonito en Excel (una vez para todo el libro)
+                wb    = writer.book
+                head  = wb.add_format({'bold': True, 'border': 1})
+                money = wb.add_format({'num_format': '$#,##0.00'})
+                qty   = wb.add_format({'num_format': '0'})
                 for prov, dfprov in tablas_por_proveedor.items():
-                    outdf = dfprov[['Cantidad','SKU','Nombre','Precio Unitario','Total']].copy()
-                    outdf.to_excel(writer, index=False, sheet_name=str(prov)[:31])
-                    # formato bonito en Excel
-                    wb  = writer.book
-                    money = wb.add_format({'num_format': '$#,##0.00'})
-                    qty   = wb.add_format({'num_format': '0'})
-                    ws = writer.sheets[str(prov)[:31]]
+                    ws = wb.add_worksheet(str(prov)[:31])
                     ws.set_column(0, 0, 10, qty)      # Cantidad
                     ws.set_column(1, 1, 12)           # SKU
                     ws.set_column(2, 2, 28)           # Nombre
                     ws.set_column(3, 4, 14, money)    # Precio, Total
+                    ws.write_row(0, 0, columnas, head)
+                    outdf = dfprov[columnas].fillna({'Nombre': ''})
+                    for i, fila in enumerate(outdf.itertuples(index=False, name=None), start=1):
+                        ws.write_row(i, 0, fila)
 
             st.download_button(
                 label="Generar Excel por proveedor",
@@ -438,4 +625,4 @@ with st.expander("🔍 Debug (opcional)"):
     st.write("Filas combinadas:", len(merged_df))
     st.write("Ganadores únicos:", len(ganadores_unicos))
     st.write("Empates reales:", len(empates_reales))
-    st.dataframe(mejores_precios_df.head())
+    st.dataframe(mejores_precios_df.drop(columns=['_sku', '_prov']).head())